@@ -1,9 +1,13 @@
 # Copyright (c) 2026 Hoa Quang Thang - Chuyên Nguyễn Tất Thành, Lào Cai
 
-from flask import Flask, request, jsonify, send_from_directory, session
+import io
+from flask import Flask, Response, request, jsonify, send_from_directory, session, stream_with_context
 from flask_cors import CORS
 from api.services.ai_service import generate_problem, analyze_solution, request_hint, generate_solution, send_chat_to_tutor
-from api.services.auth_service import register_user, login_user, save_history, update_history, load_history
+from api.services.auth_service import register_user, login_user, save_history, update_history, load_history, is_admin
+from api.services.analytics_service import get_user_stats, get_class_stats
+from api.services.export_service import export_history, import_history, EXPORT_FORMATS
+from api.services.usage_service import check_quota, track_usage, get_usage_report
 import os
 from dotenv import load_dotenv
 
@@ -25,11 +29,27 @@ def serve_app():
 def serve_static(path):
     return send_from_directory(app.static_folder, path)
 
+def check_llm_quota():
+    """Return a 429 response if the caller is over their LLM quota, otherwise None."""
+    if is_admin(session.get('user_id')):
+        return None
+    error = check_quota(session.get('user_id'), request.remote_addr)
+    if error:
+        return jsonify({"error": error}), 429
+    return None
+
+def llm_usage(endpoint):
+    return track_usage(session.get('user_id'), request.remote_addr, endpoint)
+
 @app.route('/api/generate', methods=['POST'])
 def handle_generate():
     data = request.json
+    limited = check_llm_quota()
+    if limited:
+        return limited
     try:
-        result = generate_problem(data['topic'], data['difficulty'], data.get('customRequest'))
+        with llm_usage('generate'):
+            result = generate_problem(data['topic'], data['difficulty'], data.get('customRequest'))
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -37,8 +57,12 @@ def handle_generate():
 @app.route('/api/analyze', methods=['POST'])
 def handle_analyze():
     data = request.json
+    limited = check_llm_quota()
+    if limited:
+        return limited
     try:
-        result = analyze_solution(data['problem'], data['userCode'], data['language'])
+        with llm_usage('analyze'):
+            result = analyze_solution(data['problem'], data['userCode'], data['language'])
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -46,8 +70,12 @@ def handle_analyze():
 @app.route('/api/hint', methods=['POST'])
 def handle_hint():
     data = request.json
+    limited = check_llm_quota()
+    if limited:
+        return limited
     try:
-        result = request_hint(data['problem'], data['userCode'], data['currentFeedback'])
+        with llm_usage('hint'):
+            result = request_hint(data['problem'], data['userCode'], data['currentFeedback'])
         return jsonify({"hint": result})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -55,8 +83,12 @@ def handle_hint():
 @app.route('/api/solution', methods=['POST'])
 def handle_solution():
     data = request.json
+    limited = check_llm_quota()
+    if limited:
+        return limited
     try:
-        result = generate_solution(data['problem'], data['language'])
+        with llm_usage('solution'):
+            result = generate_solution(data['problem'], data['language'])
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -64,8 +96,12 @@ def handle_solution():
 @app.route('/api/chat', methods=['POST'])
 def handle_chat():
     data = request.json
+    limited = check_llm_quota()
+    if limited:
+        return limited
     try:
-        result = send_chat_to_tutor(data['history'], data['newMessage'], data.get('currentContext'))
+        with llm_usage('chat'):
+            result = send_chat_to_tutor(data['history'], data['newMessage'], data.get('currentContext'))
         return jsonify({"text": result})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -155,5 +191,79 @@ def handle_update_history(history_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/history/export', methods=['GET'])
+def handle_export_history():
+    if 'user_id' not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+
+    # Admins may export anyone (default: everyone); students only their own attempts
+    if is_admin(session['user_id']):
+        usernames = request.args.getlist('user') or None
+    else:
+        usernames = [session['username']]
+
+    chunks = export_history(fmt, usernames, request.args.get('since'), request.args.get('until'))
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=history.{fmt}'}
+    )
+
+@app.route('/api/history/import', methods=['POST'])
+def handle_import_history():
+    if 'user_id' not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    if not is_admin(session['user_id']):
+        return jsonify({"error": "Admin access required"}), 403
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format: {fmt}"}), 400
+    try:
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        result = import_history(stream, fmt, request.args.get('createUsers') == 'true')
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# === Analytics Endpoints ===
+
+@app.route('/api/stats/me', methods=['GET'])
+def handle_my_stats():
+    if 'user_id' not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    try:
+        result = get_user_stats(session['user_id'])
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/stats/class', methods=['GET'])
+def handle_class_stats():
+    if 'user_id' not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    try:
+        result = get_class_stats()
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# === Usage Endpoints ===
+
+@app.route('/api/usage', methods=['GET'])
+def handle_usage_report():
+    if 'user_id' not in session:
+        return jsonify({"error": "Not authenticated"}), 401
+    if not is_admin(session['user_id']):
+        return jsonify({"error": "Admin access required"}), 403
+    try:
+        result = get_usage_report(request.args.get('since'), request.args.get('until'))
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     app.run(debug=True, port=3434)
@@ -2,8 +2,11 @@
 import os
 import json
 import re
+import threading
+from contextlib import contextmanager
 import requests
 from api.prompts import PROMPTS
+from api.services.usage_service import record_llm_usage
 
 # Ollama Configuration
 def get_ollama_config():
@@ -14,13 +17,189 @@ def get_ollama_config():
         'model_thinking': os.environ.get('OLLAMA_MODEL_THINKING', 'gemini-3-flash-preview')
     }
 
-def call_ollama_generate(model: str, prompt: str, system: str = None) -> str:
+class OllamaJSONError(Exception):
+    """The model answered, but not with parseable JSON (malformed or truncated)"""
+
+class OllamaTruncatedError(Exception):
+    """The model hit num_predict before finishing (done_reason == 'length')"""
+
+def get_routing_config():
+    """Get model routing thresholds from environment variables"""
+    return {
+        'small_code_lines': int(os.environ.get('ROUTING_SMALL_CODE_LINES', '40')),
+        'large_code_lines': int(os.environ.get('ROUTING_LARGE_CODE_LINES', '150')),
+        'busy_queue_depth': int(os.environ.get('ROUTING_BUSY_QUEUE_DEPTH', '3')),
+        # -1 = no limit
+        'thinking_num_predict': int(os.environ.get('ROUTING_THINKING_NUM_PREDICT', '-1')),
+        # Fixed per model: Ollama reloads the model whenever num_ctx changes
+        'num_ctx_fast': int(os.environ.get('OLLAMA_NUM_CTX_FAST', '8192')),
+        'num_ctx_thinking': int(os.environ.get('OLLAMA_NUM_CTX_THINKING', '16384'))
+    }
+
+# Number of LLM requests currently waiting on Ollama
+_inflight_lock = threading.Lock()
+_inflight_requests = 0
+
+@contextmanager
+def _track_inflight():
+    global _inflight_requests
+    with _inflight_lock:
+        _inflight_requests += 1
+    try:
+        yield
+    finally:
+        with _inflight_lock:
+            _inflight_requests -= 1
+
+def get_queue_depth() -> int:
+    """Number of LLM requests in flight, including ones queued inside Ollama"""
+    return _inflight_requests
+
+# Checked in order hard -> medium -> easy ("Kết hợp thuật toán cơ bản" is medium)
+HARD_DIFFICULTY_KEYWORDS = ('nâng cao', 'hsg', 'khó', 'hard', 'expert')
+MEDIUM_DIFFICULTY_KEYWORDS = ('kết hợp', 'trung bình', 'medium')
+EASY_DIFFICULTY_KEYWORDS = ('cơ bản', 'dễ', 'easy')
+
+# Output budget (num_predict) per task on the fast model. The thinking model is
+# capped by ROUTING_THINKING_NUM_PREDICT instead, since its reasoning tokens count too.
+NUM_PREDICT = {
+    'generate_problem': 1536,
+    'analyze': 1024,
+    'hint': 512,
+    'solution': 2048,
+    'chat': 1024
+}
+
+def classify_difficulty(difficulty: str) -> str:
+    """Map a free-form difficulty label to 'easy', 'medium' or 'hard'"""
+    label = (difficulty or '').lower()
+    if any(keyword in label for keyword in HARD_DIFFICULTY_KEYWORDS):
+        return 'hard'
+    if any(keyword in label for keyword in MEDIUM_DIFFICULTY_KEYWORDS):
+        return 'medium'
+    if any(keyword in label for keyword in EASY_DIFFICULTY_KEYWORDS):
+        return 'easy'
+    return 'medium'
+
+def _num_predict_for(task: str, tier: str) -> int:
+    # The fast caps only make sense for a separate non-thinking model: a thinking
+    # model spends part of num_predict on reasoning
+    config = get_ollama_config()
+    if tier == 'thinking' or config['model_fast'] == config['model_thinking']:
+        return get_routing_config()['thinking_num_predict']
+    return NUM_PREDICT.get(task, NUM_PREDICT['chat'])
+
+def _num_ctx_for(model: str) -> int:
+    """One num_ctx per model (the thinking setting wins if both tiers use the same model)"""
+    routing = get_routing_config()
+    if model == get_ollama_config()['model_thinking']:
+        return routing['num_ctx_thinking']
+    return routing['num_ctx_fast']
+
+def route_request(task: str, code: str = '', difficulty: str = '', input_chars: int = 0) -> dict:
+    """
+    Pick the model, num_ctx and num_predict for an LLM request
+    Args:
+        task: One of the NUM_PREDICT keys
+        code: User code submitted with the request, if any
+        difficulty: Problem difficulty label, if known
+        input_chars: Total size of the prompt in characters
+    Returns:
+        Routing decision dict, also logged for policy tuning
+    """
+    config = get_ollama_config()
+    routing = get_routing_config()
+
+    code_lines = len(code.strip().splitlines()) if code else 0
+    level = classify_difficulty(difficulty)
+    queue_depth = get_queue_depth()
+    busy = queue_depth >= routing['busy_queue_depth']
+
+    if task == 'analyze':
+        if level == 'hard' or code_lines > routing['large_code_lines']:
+            tier, reason = 'thinking', 'hard problem or long code'
+        elif level == 'easy' and code_lines <= routing['small_code_lines']:
+            tier, reason = 'fast', 'easy problem with short code'
+        elif busy:
+            tier, reason = 'fast', 'queue busy'
+        else:
+            tier, reason = 'thinking', 'default for analysis'
+    elif task == 'solution':
+        if level == 'easy':
+            tier, reason = 'fast', 'easy problem'
+        elif level == 'medium' and busy:
+            tier, reason = 'fast', 'queue busy'
+        else:
+            tier, reason = 'thinking', 'default for solutions'
+    else:
+        tier, reason = 'fast', f'default for {task}'
+
+    num_predict = _num_predict_for(task, tier)
+    model = config['model_fast'] if tier == 'fast' else config['model_thinking']
+    decision = {
+        'task': task,
+        'tier': tier,
+        'model': model,
+        'num_ctx': _num_ctx_for(model),
+        'num_predict': num_predict,
+        'reason': reason,
+        'input_chars': input_chars,
+        'code_lines': code_lines,
+        'difficulty': level,
+        'queue_depth': queue_depth
+    }
+    _log_routing(decision)
+    return decision
+
+def escalate_route(decision: dict, reason: str) -> dict:
+    """Re-route a fast-tier request to the thinking model, without the fast output cap"""
+    config = get_ollama_config()
+    num_predict = _num_predict_for(decision['task'], 'thinking')
+
+    escalated = dict(decision)
+    escalated.update({
+        'tier': 'thinking',
+        'model': config['model_thinking'],
+        'num_ctx': _num_ctx_for(config['model_thinking']),
+        'num_predict': num_predict,
+        'reason': f"escalated: {reason}",
+        'queue_depth': get_queue_depth()
+    })
+    _log_routing(escalated)
+    return escalated
+
+def _call_routed(route: dict, call):
+    """
+    Run call(route); on the fast tier, retry once on the thinking tier (no output cap)
+    if the answer was cut off by num_predict or is not valid JSON
+    Returns:
+        (result, route actually used)
+    """
+    try:
+        return call(route), route
+    except (OllamaTruncatedError, OllamaJSONError) as e:
+        # Connection errors and timeouts are not retried
+        if route['tier'] != 'fast':
+            raise
+        route = escalate_route(route, str(e))
+        return call(route), route
+
+def _log_routing(decision: dict):
+    print(f"Routing decision: {json.dumps(decision, ensure_ascii=False)}")
+
+def _route_options(decision: dict) -> dict:
+    return {'num_ctx': decision['num_ctx'], 'num_predict': decision['num_predict']}
+
+def call_ollama_generate(model: str, prompt: str, system: str = None, options: dict = None,
+                         fail_on_truncation: bool = False) -> str:
     """
     Call Ollama generate API via REST
     Args:
         model: Model name to use
         prompt: User prompt
         system: Optional system instruction
+        options: Optional extra Ollama options (num_ctx, num_predict, ...)
+        fail_on_truncation: Raise OllamaTruncatedError if num_predict cut the answer off
     Returns:
         Generated text response
     """
@@ -32,7 +211,8 @@ def call_ollama_generate(model: str, prompt: str, system: str = None) -> str:
         'prompt': prompt,
         'stream': False,
         'options': {
-            'temperature': 0.7
+            'temperature': 0.7,
+            **(options or {})
         }
     }
     
@@ -40,10 +220,11 @@ def call_ollama_generate(model: str, prompt: str, system: str = None) -> str:
         payload['system'] = system
     
     try:
-        response = requests.post(url, json=payload, timeout=120)
+        with _track_inflight():
+            response = requests.post(url, json=payload, timeout=120)
         response.raise_for_status()
         data = response.json()
-        return data.get('response', '')
+        record_llm_usage(data)
     except requests.exceptions.ConnectionError:
         raise Exception("Không thể kết nối đến Ollama server. Vui lòng kiểm tra Ollama đã được khởi động chưa.")
     except requests.exceptions.Timeout:
@@ -54,8 +235,13 @@ def call_ollama_generate(model: str, prompt: str, system: str = None) -> str:
     except Exception as e:
         print(f"Ollama API Error: {e}")
         raise Exception(f"Lỗi khi gọi Ollama: {str(e)}")
+    
+    if fail_on_truncation and data.get('done_reason') == 'length':
+        raise OllamaTruncatedError("Câu trả lời của AI bị cắt ngắn.")
+    return data.get('response', '')
 
-def call_ollama_json(model: str, prompt: str, system: str = None, schema_example: dict = None) -> dict:
+def call_ollama_json(model: str, prompt: str, system: str = None, schema_example: dict = None,
+                     options: dict = None, fail_on_truncation: bool = False) -> dict:
     """
     Call Ollama and expect JSON response
     Args:
@@ -63,6 +249,8 @@ def call_ollama_json(model: str, prompt: str, system: str = None, schema_example
         prompt: User prompt
         system: Optional system instruction
         schema_example: Example schema to guide the model
+        options: Optional extra Ollama options
+        fail_on_truncation: Raise OllamaTruncatedError if num_predict cut the answer off
     Returns:
         Parsed JSON object
     """
@@ -74,7 +262,7 @@ def call_ollama_json(model: str, prompt: str, system: str = None, schema_example
     
     full_prompt = prompt + json_instruction
     
-    response_text = call_ollama_generate(model, full_prompt, system)
+    response_text = call_ollama_generate(model, full_prompt, system, options, fail_on_truncation)
     
     # Clean response - remove markdown code fences if present
     cleaned = response_text.strip()
@@ -89,14 +277,17 @@ def call_ollama_json(model: str, prompt: str, system: str = None, schema_example
     except json.JSONDecodeError as e:
         print(f"JSON Parse Error: {e}")
         print(f"Raw response: {response_text}")
-        raise Exception("AI trả về format không hợp lệ. Vui lòng thử lại.")
+        raise OllamaJSONError("AI trả về format không hợp lệ. Vui lòng thử lại.")
 
-def call_ollama_chat(model: str, messages: list) -> str:
+def call_ollama_chat(model: str, messages: list, options: dict = None,
+                     fail_on_truncation: bool = False) -> str:
     """
     Call Ollama chat API via REST
     Args:
         model: Model name
         messages: List of message dicts with 'role' and 'content'
+        options: Optional extra Ollama options (num_ctx, num_predict, ...)
+        fail_on_truncation: Raise OllamaTruncatedError if num_predict cut the answer off
     Returns:
         Assistant's response text
     """
@@ -109,11 +300,15 @@ def call_ollama_chat(model: str, messages: list) -> str:
         'stream': False
     }
     
+    if options:
+        payload['options'] = options
+    
     try:
-        response = requests.post(url, json=payload, timeout=120)
+        with _track_inflight():
+            response = requests.post(url, json=payload, timeout=120)
         response.raise_for_status()
         data = response.json()
-        return data.get('message', {}).get('content', '')
+        record_llm_usage(data)
     except requests.exceptions.ConnectionError:
         raise Exception("Không thể kết nối đến Ollama server.")
     except requests.exceptions.HTTPError as e:
@@ -122,6 +317,10 @@ def call_ollama_chat(model: str, messages: list) -> str:
     except Exception as e:
         print(f"Ollama Chat Error: {e}")
         raise Exception(f"Lỗi khi chat với AI: {str(e)}")
+    
+    if fail_on_truncation and data.get('done_reason') == 'length':
+        raise OllamaTruncatedError("Câu trả lời của AI bị cắt ngắn.")
+    return data.get('message', {}).get('content', '')
 
 # Schemas for reference
 PROBLEM_SCHEMA_EXAMPLE = {
@@ -148,19 +347,20 @@ SOLUTION_SCHEMA_EXAMPLE = {
 
 def generate_problem(topic: str, difficulty: str, custom_request: str = None):
     """Generate a competitive programming problem"""
-    config = get_ollama_config()
-    
     user_instruction = PROMPTS.generate_problem_instruction(topic, difficulty, custom_request)
     prompt = PROMPTS.generate_problem(user_instruction)
     system = PROMPTS.generate_problem_system
+    route = route_request('generate_problem', difficulty=difficulty, input_chars=len(prompt) + len(system))
 
     try:
-        data = call_ollama_json(
-            model=config['model_fast'],
+        data, route = _call_routed(route, lambda r: call_ollama_json(
+            model=r['model'],
             prompt=prompt,
             system=system,
-            schema_example=PROBLEM_SCHEMA_EXAMPLE
-        )
+            schema_example=PROBLEM_SCHEMA_EXAMPLE,
+            options=_route_options(r),
+            fail_on_truncation=r['tier'] == 'fast'
+        ))
         
         # Fallback if topic/difficulty missing
         if not data.get("topic"): 
@@ -173,10 +373,30 @@ def generate_problem(topic: str, difficulty: str, custom_request: str = None):
         print(f"Error generating problem: {e}")
         raise e
 
+def _parse_verdict(raw_text: str):
+    """Split '[VERDICT] feedback' output into (verdict, feedback)"""
+    match = re.search(r'^\[(.*?)\]', raw_text)
+    verdict_code = 'UNKNOWN'
+    feedback_text = raw_text
+
+    if match:
+        verdict_code = match.group(1)
+        feedback_text = raw_text[len(match.group(0)):].strip()
+
+    verdict = 'UNKNOWN'
+    if 'SAI_HUONG' in verdict_code: 
+        verdict = 'WRONG_DIRECTION'
+    elif 'THIEU_SOT' in verdict_code: 
+        verdict = 'PARTIAL'
+    elif 'DUNG' in verdict_code: 
+        verdict = 'CORRECT'
+    elif 'XUAT_SAC' in verdict_code: 
+        verdict = 'EXCELLENT'
+
+    return verdict, feedback_text
+
 def analyze_solution(problem: dict, user_code: str, language: str):
     """Analyze user's solution and provide feedback"""
-    config = get_ollama_config()
-    
     prompt = PROMPTS.analyze_solution(
         problem['title'], 
         problem['description'], 
@@ -184,31 +404,25 @@ def analyze_solution(problem: dict, user_code: str, language: str):
         user_code, 
         language
     )
+    route = route_request('analyze', code=user_code, difficulty=problem.get('difficulty', ''),
+                          input_chars=len(prompt))
 
-    try:
-        raw_text = call_ollama_generate(
-            model=config['model_thinking'],
-            prompt=prompt
+    def judge(r):
+        return call_ollama_generate(
+            model=r['model'],
+            prompt=prompt,
+            options=_route_options(r),
+            fail_on_truncation=r['tier'] == 'fast'
         )
-        
-        # Parse verdict
-        match = re.search(r'^\[(.*?)\]', raw_text)
-        verdict_code = 'UNKNOWN'
-        feedback_text = raw_text
-
-        if match:
-            verdict_code = match.group(1)
-            feedback_text = raw_text[len(match.group(0)):].strip()
-
-        verdict = 'UNKNOWN'
-        if 'SAI_HUONG' in verdict_code: 
-            verdict = 'WRONG_DIRECTION'
-        elif 'THIEU_SOT' in verdict_code: 
-            verdict = 'PARTIAL'
-        elif 'DUNG' in verdict_code: 
-            verdict = 'CORRECT'
-        elif 'XUAT_SAC' in verdict_code: 
-            verdict = 'EXCELLENT'
+
+    try:
+        raw_text, route = _call_routed(route, judge)
+        verdict, feedback_text = _parse_verdict(raw_text)
+
+        # The fast tier could not commit to a verdict: ask again on the thinking tier
+        if verdict == 'UNKNOWN' and route['tier'] == 'fast':
+            route = escalate_route(route, 'verdict UNKNOWN')
+            verdict, feedback_text = _parse_verdict(judge(route))
 
         return {
             "verdict": verdict,
@@ -220,33 +434,36 @@ def analyze_solution(problem: dict, user_code: str, language: str):
 
 def request_hint(problem: dict, user_code: str, current_feedback: str):
     """Provide a hint for the problem"""
-    config = get_ollama_config()
-    
     prompt = PROMPTS.request_hint(problem['title'], user_code, current_feedback)
+    route = route_request('hint', code=user_code, difficulty=problem.get('difficulty', ''),
+                          input_chars=len(prompt))
     
-    response = call_ollama_generate(
-        model=config['model_fast'],
-        prompt=prompt
-    )
+    response, _ = _call_routed(route, lambda r: call_ollama_generate(
+        model=r['model'],
+        prompt=prompt,
+        options=_route_options(r),
+        fail_on_truncation=r['tier'] == 'fast'
+    ))
     return response
 
 def generate_solution(problem: dict, language: str):
     """Generate a complete solution for the problem"""
-    config = get_ollama_config()
-    
     prompt = PROMPTS.generate_solution(
         problem['title'], 
         problem['description'], 
         problem['constraints'], 
         language
     )
+    route = route_request('solution', difficulty=problem.get('difficulty', ''), input_chars=len(prompt))
 
     try:
-        data = call_ollama_json(
-            model=config['model_thinking'],
+        data, _ = _call_routed(route, lambda r: call_ollama_json(
+            model=r['model'],
             prompt=prompt,
-            schema_example=SOLUTION_SCHEMA_EXAMPLE
-        )
+            schema_example=SOLUTION_SCHEMA_EXAMPLE,
+            options=_route_options(r),
+            fail_on_truncation=r['tier'] == 'fast'
+        ))
         return data
     except Exception as e:
         print(f"Error generating solution: {e}")
@@ -254,8 +471,6 @@ def generate_solution(problem: dict, language: str):
 
 def send_chat_to_tutor(history: list, new_message: str, current_context: str = None):
     """Chat with AI tutor"""
-    config = get_ollama_config()
-    
     # Format messages for Ollama
     messages = []
     
@@ -280,5 +495,8 @@ def send_chat_to_tutor(history: list, new_message: str, current_context: str = N
         'content': new_message
     })
     
-    response = call_ollama_chat(config['model_fast'], messages)
+    route = route_request('chat', input_chars=sum(len(m['content']) for m in messages))
+    response, _ = _call_routed(route, lambda r: call_ollama_chat(
+        r['model'], messages, _route_options(r), fail_on_truncation=r['tier'] == 'fast'
+    ))
     return response
@@ -0,0 +1,330 @@
+# Copyright (c) 2026 Hoa Quang Thang - Chuyên Nguyễn Tất Thành, Lào Cai
+
+import sys
+import json
+from datetime import datetime, date, timedelta, timezone
+from api.services.db import get_db_connection
+
+# Verdict stored for attempts that have not been judged yet
+UNSUBMITTED = 'UNSUBMITTED'
+SOLVED_VERDICTS = ('CORRECT', 'EXCELLENT')
+
+# How many days of activity the stats endpoints return
+ACTIVITY_DAYS = 30
+
+def init_analytics_tables(cursor):
+    """Create the aggregate tables maintained alongside history."""
+    # Verdict counts per (user, topic, difficulty)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_topic_stats (
+            user_id INTEGER NOT NULL,
+            topic TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            verdict TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, topic, difficulty, verdict)
+        )
+    ''')
+
+    # Verdict counts per (topic, difficulty) across all users
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS class_topic_stats (
+            topic TEXT NOT NULL,
+            difficulty TEXT NOT NULL,
+            verdict TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (topic, difficulty, verdict)
+        )
+    ''')
+
+    # Attempts created per user per UTC day, and how many of them have been judged
+    # (an attempt counts as one submission however often it is re-submitted)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_daily_activity (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            submissions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+    ''')
+
+    # The same counts across all users, plus distinct active users per UTC day
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS class_daily_activity (
+            day TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            submissions INTEGER NOT NULL DEFAULT 0,
+            active_users INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Running totals and streaks per user
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_summary (
+            user_id INTEGER PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            submissions INTEGER NOT NULL DEFAULT 0,
+            solved INTEGER NOT NULL DEFAULT 0,
+            current_streak INTEGER NOT NULL DEFAULT 0,
+            longest_streak INTEGER NOT NULL DEFAULT 0,
+            last_active_day TEXT
+        )
+    ''')
+
+def utc_day(timestamp=None):
+    """Return the UTC day ('YYYY-MM-DD') of a history timestamp, or today."""
+    if timestamp:
+        return str(timestamp)[:10]
+    return datetime.now(timezone.utc).date().isoformat()
+
+def _normalize_verdict(verdict):
+    return verdict or UNSUBMITTED
+
+def _problem_bucket(problem):
+    """Extract the (topic, difficulty) pair an attempt is counted under."""
+    if not isinstance(problem, dict):
+        problem = {}
+    topic = (problem.get('topic') or '').strip() or 'Unknown'
+    difficulty = (problem.get('difficulty') or '').strip() or 'Unknown'
+    return topic, difficulty
+
+def _bump_topic(cursor, user_id, topic, difficulty, verdict, delta):
+    cursor.execute(
+        '''INSERT INTO user_topic_stats (user_id, topic, difficulty, verdict, count)
+           VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT (user_id, topic, difficulty, verdict)
+           DO UPDATE SET count = count + excluded.count''',
+        (user_id, topic, difficulty, verdict, delta)
+    )
+    cursor.execute(
+        '''INSERT INTO class_topic_stats (topic, difficulty, verdict, count)
+           VALUES (?, ?, ?, ?)
+           ON CONFLICT (topic, difficulty, verdict)
+           DO UPDATE SET count = count + excluded.count''',
+        (topic, difficulty, verdict, delta)
+    )
+
+def _bump_activity(cursor, user_id, day, attempts, submissions):
+    cursor.execute(
+        'INSERT OR IGNORE INTO user_daily_activity (user_id, day) VALUES (?, ?)',
+        (user_id, day)
+    )
+    first_today = cursor.rowcount == 1
+    cursor.execute(
+        '''UPDATE user_daily_activity
+           SET attempts = attempts + ?, submissions = submissions + ?
+           WHERE user_id = ? AND day = ?''',
+        (attempts, submissions, user_id, day)
+    )
+
+    cursor.execute('INSERT OR IGNORE INTO class_daily_activity (day) VALUES (?)', (day,))
+    cursor.execute(
+        '''UPDATE class_daily_activity
+           SET attempts = attempts + ?, submissions = submissions + ?, active_users = active_users + ?
+           WHERE day = ?''',
+        (attempts, submissions, 1 if first_today else 0, day)
+    )
+
+def _bump_summary(cursor, user_id, day, attempts, submissions, solved):
+    """Update running totals and extend the user's daily streak."""
+    cursor.execute('INSERT OR IGNORE INTO user_summary (user_id) VALUES (?)', (user_id,))
+    cursor.execute(
+        'SELECT current_streak, longest_streak, last_active_day FROM user_summary WHERE user_id = ?',
+        (user_id,)
+    )
+    current, longest, last_day = cursor.fetchone()
+
+    if last_day is None or day > last_day:
+        yesterday = (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+        current = current + 1 if last_day == yesterday else 1
+        longest = max(longest, current)
+        last_day = day
+
+    cursor.execute(
+        '''UPDATE user_summary
+           SET attempts = attempts + ?, submissions = submissions + ?, solved = solved + ?,
+               current_streak = ?, longest_streak = ?, last_active_day = ?
+           WHERE user_id = ?''',
+        (attempts, submissions, solved, current, longest, last_day, user_id)
+    )
+
+def record_attempt(cursor, user_id, problem, verdict, day):
+    """Count a newly saved history entry. Runs inside the caller's transaction."""
+    topic, difficulty = _problem_bucket(problem)
+    verdict = _normalize_verdict(verdict)
+    submitted = 0 if verdict == UNSUBMITTED else 1
+    solved = 1 if verdict in SOLVED_VERDICTS else 0
+
+    _bump_topic(cursor, user_id, topic, difficulty, verdict, 1)
+    _bump_activity(cursor, user_id, day, 1, submitted)
+    _bump_summary(cursor, user_id, day, 1, submitted, solved)
+
+def record_verdict_change(cursor, user_id, problem, old_verdict, new_verdict, day):
+    """Move a history entry to its new verdict bucket. `day` is the entry's creation day."""
+    # Counted against the attempt (not the re-submission) so backfill_analytics() rebuilds the same numbers
+    topic, difficulty = _problem_bucket(problem)
+    old_verdict = _normalize_verdict(old_verdict)
+    new_verdict = _normalize_verdict(new_verdict)
+    if old_verdict == new_verdict:
+        return
+
+    _bump_topic(cursor, user_id, topic, difficulty, old_verdict, -1)
+    _bump_topic(cursor, user_id, topic, difficulty, new_verdict, 1)
+
+    submitted = (new_verdict != UNSUBMITTED) - (old_verdict != UNSUBMITTED)
+    solved = (new_verdict in SOLVED_VERDICTS) - (old_verdict in SOLVED_VERDICTS)
+
+    _bump_activity(cursor, user_id, day, 0, submitted)
+    _bump_summary(cursor, user_id, day, 0, submitted, solved)
+
+def recompute_streaks(cursor, user_ids):
+    """Rebuild users' streaks from user_daily_activity, for attempts recorded out of day order."""
+    for user_id in user_ids:
+        cursor.execute(
+            'SELECT day FROM user_daily_activity WHERE user_id = ? AND attempts > 0 ORDER BY day',
+            (user_id,)
+        )
+        current = longest = 0
+        last_day = None
+        for (day,) in cursor.fetchall():
+            yesterday = (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+            current = current + 1 if last_day == yesterday else 1
+            longest = max(longest, current)
+            last_day = day
+
+        cursor.execute(
+            '''UPDATE user_summary SET current_streak = ?, longest_streak = ?, last_active_day = ?
+               WHERE user_id = ?''',
+            (current, longest, last_day, user_id)
+        )
+
+def _topic_breakdown(rows):
+    """Fold (topic, difficulty, verdict, count) rows into nested dicts."""
+    topics = {}
+    for row in rows:
+        if row['count'] <= 0:
+            continue
+        bucket = topics.setdefault(row['topic'], {}).setdefault(row['difficulty'], {})
+        bucket[row['verdict']] = row['count']
+    return topics
+
+def get_user_stats(user_id):
+    """Load precomputed progress stats for a user."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute(
+            '''SELECT attempts, submissions, solved, current_streak, longest_streak, last_active_day
+               FROM user_summary WHERE user_id = ?''',
+            (user_id,)
+        )
+        summary = cursor.fetchone()
+
+        cursor.execute(
+            'SELECT topic, difficulty, verdict, count FROM user_topic_stats WHERE user_id = ?',
+            (user_id,)
+        )
+        topics = _topic_breakdown(cursor.fetchall())
+
+        cursor.execute(
+            '''SELECT day, attempts, submissions FROM user_daily_activity
+               WHERE user_id = ? ORDER BY day DESC LIMIT ?''',
+            (user_id, ACTIVITY_DAYS)
+        )
+        activity = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+
+        summary = dict(summary) if summary else {
+            'attempts': 0, 'submissions': 0, 'solved': 0,
+            'current_streak': 0, 'longest_streak': 0, 'last_active_day': None
+        }
+
+        # A streak only counts as current if the user was active today or yesterday
+        if summary['last_active_day']:
+            yesterday = (date.fromisoformat(utc_day()) - timedelta(days=1)).isoformat()
+            if summary['last_active_day'] < yesterday:
+                summary['current_streak'] = 0
+
+        return {
+            'success': True,
+            'summary': {
+                'attempts': summary['attempts'],
+                'submissions': summary['submissions'],
+                'solved': summary['solved'],
+                'currentStreak': summary['current_streak'],
+                'longestStreak': summary['longest_streak'],
+                'lastActiveDay': summary['last_active_day']
+            },
+            'topics': topics,
+            'activity': activity
+        }
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def get_class_stats():
+    """Load precomputed progress stats across all users."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT topic, difficulty, verdict, count FROM class_topic_stats')
+        topics = _topic_breakdown(cursor.fetchall())
+
+        cursor.execute(
+            '''SELECT day, attempts, submissions, active_users AS activeUsers
+               FROM class_daily_activity ORDER BY day DESC LIMIT ?''',
+            (ACTIVITY_DAYS,)
+        )
+        activity = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+
+        return {'success': True, 'topics': topics, 'activity': activity}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def backfill_analytics():
+    """Rebuild all aggregate tables from the existing history rows."""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        init_analytics_tables(cursor)
+
+        for table in ('user_topic_stats', 'class_topic_stats', 'user_daily_activity',
+                      'class_daily_activity', 'user_summary'):
+            cursor.execute(f'DELETE FROM {table}')
+
+        # Replay in chronological order so streaks are rebuilt correctly
+        rows = conn.execute(
+            'SELECT user_id, problem_data, verdict, timestamp FROM history ORDER BY timestamp, id'
+        )
+        count = 0
+        for row in rows:
+            try:
+                problem = json.loads(row['problem_data'])
+            except (TypeError, ValueError):
+                problem = {}
+            record_attempt(cursor, row['user_id'], problem, row['verdict'], utc_day(row['timestamp']))
+            count += 1
+
+        conn.commit()
+        return {'success': True, 'count': count}
+    except Exception as e:
+        conn.rollback()
+        return {'success': False, 'error': str(e)}
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['backfill']:
+        print("Usage: python -m api.services.analytics_service backfill")
+        sys.exit(1)
+
+    # Make sure the base schema exists before replaying history
+    import api.services.auth_service  # noqa: F401
+    result = backfill_analytics()
+    if not result['success']:
+        print(f"Backfill failed: {result['error']}")
+        sys.exit(1)
+    print(f"Backfilled analytics from {result['count']} history entries.")
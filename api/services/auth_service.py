@@ -1,17 +1,13 @@
 # Copyright (c) 2026 Hoa Quang Thang - Chuyên Nguyễn Tất Thành, Lào Cai
 
+import sys
 import sqlite3
 import json
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-
-DATABASE_PATH = 'database.db'
-
-def get_db_connection():
-    """Create a database connection."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+from api.services.db import get_db_connection
+from api.services.analytics_service import init_analytics_tables, record_attempt, record_verdict_change, utc_day
+from api.services.usage_service import init_usage_tables
 
 def init_database():
     """Initialize the database with required tables."""
@@ -42,9 +38,55 @@ def init_database():
         )
     ''')
     
+    # Admin flag, only settable from the command line (see set_admin)
+    cursor.execute('PRAGMA table_info(users)')
+    if 'is_admin' not in [column['name'] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE users ADD COLUMN is_admin INTEGER NOT NULL DEFAULT 0')
+    
+    # Speeds up per-user history lookups and duplicate checks on import
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_history_user_timestamp ON history (user_id, timestamp)'
+    )
+    
+    # Create aggregate tables for progress analytics
+    init_analytics_tables(cursor)
+    
+    # Create LLM usage accounting table
+    init_usage_tables(cursor)
+    
     conn.commit()
     conn.close()
 
+def is_admin(user_id):
+    """Check whether a user has the admin flag."""
+    if not user_id:
+        return False
+    conn = get_db_connection()
+    row = conn.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
+    conn.close()
+    return bool(row and row['is_admin'])
+
+def set_admin(username, admin=True):
+    """Grant or revoke admin rights for an existing user."""
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            'UPDATE users SET is_admin = ? WHERE username = ?',
+            (1 if admin else 0, username)
+        )
+        
+        conn.commit()
+        updated = cursor.rowcount
+        conn.close()
+        
+        if not updated:
+            return {'success': False, 'error': 'User not found'}
+        return {'success': True}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
 def register_user(username, password):
     """Register a new user."""
     try:
@@ -100,9 +142,11 @@ def save_history(user_id, problem_data, user_code='', verdict='', language='cpp'
                VALUES (?, ?, ?, ?, ?)''',
             (user_id, problem_json, user_code, verdict, language)
         )
+        history_id = cursor.lastrowid
+        
+        record_attempt(cursor, user_id, problem_data, verdict, utc_day())
         
         conn.commit()
-        history_id = cursor.lastrowid
         conn.close()
         
         return {'success': True, 'id': history_id}
@@ -115,11 +159,27 @@ def update_history(history_id, user_code, verdict):
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        cursor.execute(
+            'SELECT user_id, problem_data, verdict, timestamp FROM history WHERE id = ?',
+            (history_id,)
+        )
+        row = cursor.fetchone()
+        
         cursor.execute(
             'UPDATE history SET user_code = ?, verdict = ? WHERE id = ?',
             (user_code, verdict, history_id)
         )
         
+        if row:
+            record_verdict_change(
+                cursor,
+                row['user_id'],
+                json.loads(row['problem_data']),
+                row['verdict'],
+                verdict,
+                utc_day(row['timestamp'])
+            )
+        
         conn.commit()
         conn.close()
         
@@ -159,3 +219,14 @@ def load_history(user_id):
 
 # Initialize database on import
 init_database()
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in ('grant-admin', 'revoke-admin'):
+        print("Usage: python -m api.services.auth_service grant-admin|revoke-admin <username>")
+        sys.exit(1)
+
+    result = set_admin(sys.argv[2], sys.argv[1] == 'grant-admin')
+    if not result['success']:
+        print(f"Failed: {result['error']}")
+        sys.exit(1)
+    print(f"{sys.argv[1]}: {sys.argv[2]}")
@@ -0,0 +1,11 @@
+# Copyright (c) 2026 Hoa Quang Thang - Chuyên Nguyễn Tất Thành, Lào Cai
+
+import sqlite3
+
+DATABASE_PATH = 'database.db'
+
+def get_db_connection():
+    """Create a database connection."""
+    conn = sqlite3.connect(DATABASE_PATH)
+    conn.row_factory = sqlite3.Row
+    return conn
@@ -0,0 +1,288 @@
+# Copyright (c) 2026 Hoa Quang Thang - Chuyên Nguyễn Tất Thành, Lào Cai
+
+import io
+import sys
+import csv
+import json
+import secrets
+import argparse
+import tempfile
+from werkzeug.security import generate_password_hash
+from api.services.db import get_db_connection
+from api.services.analytics_service import record_attempt, recompute_streaks, utc_day
+
+# Rows fetched from / written to SQLite per round trip
+CHUNK_SIZE = 1000
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_FIELDS = ['username', 'problem', 'userCode', 'verdict', 'language', 'timestamp']
+
+# Problem statements and submitted code can exceed csv's default 128KB field limit
+csv.field_size_limit(2 ** 31 - 1)
+
+def _export_query(usernames=None, since=None, until=None):
+    """Keyset-paginated query: takes the last exported id and returns the next CHUNK_SIZE rows."""
+    sql = '''SELECT h.id, u.username, h.problem_data, h.user_code, h.verdict, h.language, h.timestamp
+             FROM history h JOIN users u ON u.id = h.user_id
+             WHERE h.id > ?'''
+    params = []
+    if usernames:
+        sql += f" AND u.username IN ({', '.join('?' for _ in usernames)})"
+        params.extend(usernames)
+    if since:
+        sql += ' AND h.timestamp >= ?'
+        params.append(since)
+    if until:
+        sql += ' AND h.timestamp < ?'
+        params.append(until)
+    return sql + f' ORDER BY h.id LIMIT {CHUNK_SIZE}', params
+
+def _ndjson_line(row):
+    # problem_data is already JSON: splice it in instead of decoding and re-encoding it
+    head = json.dumps({
+        'username': row['username'],
+        'userCode': row['user_code'],
+        'verdict': row['verdict'],
+        'language': row['language'],
+        'timestamp': row['timestamp']
+    }, ensure_ascii=False)
+    return f'{head[:-1]}, "problem": {row["problem_data"]}}}\n'
+
+def export_history(fmt='ndjson', usernames=None, since=None, until=None):
+    """
+    Stream history rows as NDJSON or CSV text chunks
+    Args:
+        fmt: 'ndjson' or 'csv'
+        usernames: Optional list of usernames to export (default: everyone)
+        since: Optional inclusive lower bound on timestamp ('YYYY-MM-DD[ HH:MM:SS]')
+        until: Optional exclusive upper bound on timestamp
+    Yields:
+        Strings of at most CHUNK_SIZE serialized rows
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    sql, params = _export_query(usernames, since, until)
+    conn = get_db_connection()
+    try:
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_FIELDS)
+            yield buffer.getvalue()
+
+        last_id = 0
+        while True:
+            # Each chunk is a short, fully consumed read, so no lock is held while the
+            # client downloads (a paused download would otherwise block every writer)
+            rows = conn.execute(sql, [last_id] + params).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            if fmt == 'ndjson':
+                yield ''.join(_ndjson_line(row) for row in rows)
+            else:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(
+                    (row['username'], row['problem_data'], row['user_code'],
+                     row['verdict'], row['language'], row['timestamp'])
+                    for row in rows
+                )
+                yield buffer.getvalue()
+    finally:
+        conn.close()
+
+def _read_records(stream, fmt):
+    """Parse an NDJSON or CSV text stream into export records, one at a time."""
+    if fmt == 'ndjson':
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            record['problem'] = json.dumps(record['problem'])
+            yield record
+    elif fmt == 'csv':
+        for record in csv.DictReader(stream):
+            json.loads(record['problem'])  # Reject rows load_history could not decode
+            yield record
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+def _spool_records(stream, fmt):
+    """Parse and validate the whole input into a temp file, before any write lock is taken."""
+    spool = tempfile.TemporaryFile('w+', encoding='utf-8')
+    try:
+        for record in _read_records(stream, fmt):
+            spool.write(json.dumps([
+                record['username'],
+                record['problem'],
+                record.get('userCode') or '',
+                record.get('verdict') or '',
+                record.get('language') or 'cpp',
+                record['timestamp']
+            ]) + '\n')
+        spool.seek(0)
+        return spool
+    except Exception:
+        spool.close()
+        raise
+
+def _resolve_user(cursor, cache, username, create_users):
+    if username in cache:
+        return cache[username]
+
+    cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+    user = cursor.fetchone()
+    if user:
+        user_id = user['id']
+    elif create_users:
+        # Imported accounts get a random password; the owner must be given a new one
+        cursor.execute(
+            'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+            (username, generate_password_hash(secrets.token_urlsafe(32)))
+        )
+        user_id = cursor.lastrowid
+    else:
+        user_id = None
+
+    cache[username] = user_id
+    return user_id
+
+def _flush_batch(cursor, batch, affected_users):
+    """Insert the rows of a batch that are not already in history and count them in analytics."""
+    # Earlier batches are visible to the SELECT below; `seen` catches duplicates within this one
+    seen = set()
+    new_rows = []
+    for row in batch:
+        user_id, problem, _, _, _, timestamp = row
+        key = (user_id, timestamp, problem)
+        if key in seen:
+            continue
+        cursor.execute(
+            'SELECT 1 FROM history WHERE user_id = ? AND timestamp = ? AND problem_data = ?',
+            key
+        )
+        if cursor.fetchone() is None:
+            seen.add(key)
+            new_rows.append(row)
+
+    cursor.executemany(
+        '''INSERT INTO history (user_id, problem_data, user_code, verdict, language, timestamp)
+           VALUES (?, ?, ?, ?, ?, ?)''',
+        new_rows
+    )
+
+    # Imported rows bypass save_history, so update the aggregates here
+    for user_id, problem, _, verdict, _, timestamp in new_rows:
+        record_attempt(cursor, user_id, json.loads(problem), verdict, utc_day(timestamp))
+        affected_users.add(user_id)
+    return len(new_rows)
+
+def import_history(stream, fmt='ndjson', create_users=False):
+    """
+    Bulk import history records produced by export_history
+    Args:
+        stream: Iterable of text lines (file object or request stream)
+        fmt: 'ndjson' or 'csv'
+        create_users: Create accounts for usernames missing from this database
+    Returns:
+        Dict with inserted / duplicate / skipped counts. The import is a single
+        transaction: on error nothing is written.
+    """
+    # Read the upload first so the write transaction does not wait on the client
+    try:
+        spool = _spool_records(stream, fmt)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        users = {}
+        affected_users = set()
+        batch = []
+        inserted = total = skipped = 0
+
+        for line in spool:
+            username, *row = json.loads(line)
+            user_id = _resolve_user(cursor, users, username, create_users)
+            if user_id is None:
+                skipped += 1
+                continue
+
+            batch.append((user_id, *row))
+            if len(batch) >= CHUNK_SIZE:
+                total += len(batch)
+                inserted += _flush_batch(cursor, batch, affected_users)
+                batch = []
+
+        if batch:
+            total += len(batch)
+            inserted += _flush_batch(cursor, batch, affected_users)
+
+        # record_attempt only extends streaks forward in time; imported rows may be older
+        recompute_streaks(cursor, affected_users)
+        conn.commit()
+
+        return {
+            'success': True,
+            'inserted': inserted,
+            'duplicates': total - inserted,
+            'skipped': skipped
+        }
+    except Exception as e:
+        conn.rollback()
+        return {'success': False, 'error': str(e)}
+    finally:
+        conn.close()
+        spool.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m api.services.export_service',
+        description='Export or import problem attempt history.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_cmd = commands.add_parser('export', help='Write history to a file (or stdout)')
+    export_cmd.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+    export_cmd.add_argument('--user', action='append', dest='usernames', help='Username to export (repeatable)')
+    export_cmd.add_argument('--since', help='Only attempts at or after this date (YYYY-MM-DD)')
+    export_cmd.add_argument('--until', help='Only attempts before this date (YYYY-MM-DD)')
+    export_cmd.add_argument('--output', '-o', help='Output file (default: stdout)')
+
+    import_cmd = commands.add_parser('import', help='Load history from an export file')
+    import_cmd.add_argument('input', help='Export file to import')
+    import_cmd.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+    import_cmd.add_argument('--create-users', action='store_true',
+                            help='Create accounts for unknown usernames (with random passwords)')
+
+    args = parser.parse_args(argv)
+
+    # Make sure the schema exists before touching it
+    import api.services.auth_service  # noqa: F401
+
+    if args.command == 'export':
+        out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+        try:
+            for chunk in export_history(args.format, args.usernames, args.since, args.until):
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+        return 0
+
+    with open(args.input, encoding='utf-8', newline='') as f:
+        result = import_history(f, args.format, args.create_users)
+    if not result['success']:
+        print(f"Import failed: {result['error']}", file=sys.stderr)
+        return 1
+    print(f"Imported {result['inserted']} entries "
+          f"({result['duplicates']} duplicates, {result['skipped']} for unknown users skipped).")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+# Copyright (c) 2026 Hoa Quang Thang - Chuyên Nguyễn Tất Thành, Lào Cai
+
+import os
+import time
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+from api.services.db import get_db_connection
+from api.services.analytics_service import utc_day
+
+# user_id recorded for requests made without logging in
+ANONYMOUS_USER_ID = 0
+
+def get_quota_config():
+    """Get usage quota and flush settings from environment variables (0 = unlimited)"""
+    return {
+        'requests_per_minute': int(os.environ.get('QUOTA_REQUESTS_PER_MINUTE', '10')),
+        'tokens_per_day': int(os.environ.get('QUOTA_TOKENS_PER_DAY', '200000')),
+        'flush_interval': float(os.environ.get('USAGE_FLUSH_INTERVAL', '30')),
+        'flush_batch': int(os.environ.get('USAGE_FLUSH_BATCH', '50'))
+    }
+
+def init_usage_tables(cursor):
+    """Create the per-user, per-endpoint daily usage table."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS usage_daily (
+            user_id INTEGER NOT NULL,
+            endpoint TEXT NOT NULL,
+            day TEXT NOT NULL,
+            requests INTEGER NOT NULL DEFAULT 0,
+            llm_calls INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            gpu_ms INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, endpoint, day)
+        )
+    ''')
+
+_lock = threading.Lock()
+# (user_id, endpoint, day) -> [requests, llm_calls, prompt_tokens, completion_tokens, gpu_ms]
+_pending = {}
+_pending_events = 0
+_last_flush = time.monotonic()
+# quota key -> [tokens used today, monotonic time loaded] / timestamps of requests
+# in the last minute. Logged-in users' daily totals are re-read from usage_daily
+# every flush interval, so the daily limit holds across workers (give or take
+# other workers' unflushed usage). Per-minute windows and anonymous (per-IP)
+# daily totals live in this process only: each worker enforces its own, and
+# they start over after a restart.
+_daily_tokens = {}
+_daily_tokens_day = None
+_minute_windows = {}
+_last_window_sweep = time.monotonic()
+# Usage context of the request being served on this thread
+_context = threading.local()
+
+def _quota_key(user_id, remote_addr):
+    return f"user:{user_id}" if user_id else f"ip:{remote_addr}"
+
+def _add_pending(user_id, endpoint, day, counters):
+    global _pending_events
+    row = _pending.setdefault((user_id, endpoint, day), [0, 0, 0, 0, 0])
+    for i, value in enumerate(counters):
+        row[i] += value
+    _pending_events += 1
+
+def _reset_daily_tokens(day):
+    """Start a new day's token counters. Caller holds _lock."""
+    global _daily_tokens, _daily_tokens_day
+    if _daily_tokens_day != day:
+        _daily_tokens = {}
+        _daily_tokens_day = day
+
+def _load_daily_tokens(user_id, day):
+    """Tokens a user has used on a day according to SQLite. Called without _lock held."""
+    if not user_id:
+        return 0
+    conn = get_db_connection()
+    row = conn.execute(
+        '''SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0)
+           FROM usage_daily WHERE user_id = ? AND day = ?''',
+        (user_id, day)
+    ).fetchone()
+    conn.close()
+    return row[0]
+
+def _sweep_minute_windows(now):
+    """Drop per-minute windows of callers idle for over a minute. Caller holds _lock."""
+    global _last_window_sweep
+    if now - _last_window_sweep < 60:
+        return
+    _last_window_sweep = now
+    for key in [key for key, window in _minute_windows.items() if not window or now - window[-1] >= 60]:
+        del _minute_windows[key]
+
+def check_quota(user_id, remote_addr):
+    """
+    Check per-minute and daily quotas before a request reaches the LLM
+    Args:
+        user_id: Logged-in user id, or None for anonymous requests
+        remote_addr: Client address, used to key anonymous quotas
+    Returns:
+        Error message if a quota is exceeded, otherwise None
+    """
+    config = get_quota_config()
+    key = _quota_key(user_id, remote_addr)
+    day = utc_day()
+
+    if config['tokens_per_day']:
+        with _lock:
+            _reset_daily_tokens(day)
+            entry = _daily_tokens.get(key)
+            # Anonymous totals are not in usage_daily per IP, so they are never re-read
+            stale = entry is None or (
+                user_id and time.monotonic() - entry[1] >= config['flush_interval']
+            )
+        if stale:
+            # Read SQLite without blocking other threads (a flush running concurrently
+            # can make this undercount until the next refresh; quotas are approximate)
+            stored = _load_daily_tokens(user_id, day)
+            with _lock:
+                _reset_daily_tokens(day)
+                # Add this process's usage recorded since the last flush
+                _daily_tokens[key] = [stored + sum(
+                    counters[2] + counters[3]
+                    for (pending_user, _, pending_day), counters in _pending.items()
+                    if user_id and pending_user == user_id and pending_day == day
+                ), time.monotonic()]
+
+    now = time.monotonic()
+    with _lock:
+        if config['tokens_per_day'] and \
+                _daily_tokens.get(key, [0])[0] >= config['tokens_per_day']:
+            return "Daily AI usage limit reached. Please try again tomorrow."
+
+        if config['requests_per_minute']:
+            _sweep_minute_windows(now)
+            window = _minute_windows.setdefault(key, deque())
+            while window and now - window[0] >= 60:
+                window.popleft()
+            if len(window) >= config['requests_per_minute']:
+                return "Too many AI requests. Please wait a minute and try again."
+            window.append(now)
+
+    return None
+
+@contextmanager
+def track_usage(user_id, remote_addr, endpoint):
+    """Attribute LLM calls made inside this block to a user and endpoint."""
+    user_id = user_id or ANONYMOUS_USER_ID
+    with _lock:
+        _add_pending(user_id, endpoint, utc_day(), (1, 0, 0, 0, 0))
+
+    _context.current = (user_id, _quota_key(user_id, remote_addr), endpoint)
+    try:
+        yield
+    finally:
+        _context.current = None
+        _maybe_flush()
+
+def record_llm_usage(data: dict):
+    """Count tokens and GPU time from an Ollama generate/chat response."""
+    current = getattr(_context, 'current', None)
+    if current is None:
+        return
+    user_id, key, endpoint = current
+
+    prompt_tokens = data.get('prompt_eval_count') or 0
+    completion_tokens = data.get('eval_count') or 0
+    # Durations are reported in nanoseconds
+    gpu_ms = ((data.get('prompt_eval_duration') or 0) + (data.get('eval_duration') or 0)) // 1_000_000
+    day = utc_day()
+
+    with _lock:
+        _add_pending(user_id, endpoint, day, (0, 1, prompt_tokens, completion_tokens, gpu_ms))
+        if _daily_tokens_day == day and key in _daily_tokens:
+            _daily_tokens[key][0] += prompt_tokens + completion_tokens
+
+def _maybe_flush():
+    config = get_quota_config()
+    if _pending_events >= config['flush_batch'] or \
+            time.monotonic() - _last_flush >= config['flush_interval']:
+        flush_usage()
+
+def flush_usage():
+    """Write the in-memory counters to SQLite in one batched transaction."""
+    global _pending, _pending_events, _last_flush
+    with _lock:
+        pending, _pending = _pending, {}
+        _pending_events = 0
+        _last_flush = time.monotonic()
+    if not pending:
+        return
+
+    try:
+        conn = get_db_connection()
+        with conn:
+            conn.executemany(
+                '''INSERT INTO usage_daily
+                       (user_id, endpoint, day, requests, llm_calls, prompt_tokens, completion_tokens, gpu_ms)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (user_id, endpoint, day) DO UPDATE SET
+                       requests = requests + excluded.requests,
+                       llm_calls = llm_calls + excluded.llm_calls,
+                       prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                       completion_tokens = completion_tokens + excluded.completion_tokens,
+                       gpu_ms = gpu_ms + excluded.gpu_ms''',
+                [key + tuple(counters) for key, counters in pending.items()]
+            )
+        conn.close()
+    except Exception as e:
+        print(f"Usage flush error: {e}")
+        # Put the counters back so they are retried on the next flush
+        with _lock:
+            for (user_id, endpoint, day), counters in pending.items():
+                _add_pending(user_id, endpoint, day, counters)
+
+atexit.register(flush_usage)
+
+def get_usage_report(since=None, until=None):
+    """Load usage totals per user and endpoint for a day range (default: today)."""
+    try:
+        flush_usage()
+        since = since or utc_day()
+        until = until or since
+
+        conn = get_db_connection()
+        rows = conn.execute(
+            '''SELECT d.user_id, COALESCE(u.username, 'anonymous') AS username, d.endpoint,
+                      SUM(d.requests) AS requests, SUM(d.llm_calls) AS llm_calls,
+                      SUM(d.prompt_tokens) AS prompt_tokens,
+                      SUM(d.completion_tokens) AS completion_tokens,
+                      SUM(d.gpu_ms) AS gpu_ms
+               FROM usage_daily d LEFT JOIN users u ON u.id = d.user_id
+               WHERE d.day >= ? AND d.day <= ?
+               GROUP BY d.user_id, d.endpoint
+               ORDER BY SUM(d.prompt_tokens + d.completion_tokens) DESC''',
+            (since, until)
+        ).fetchall()
+        conn.close()
+
+        users = {}
+        totals = {'requests': 0, 'llmCalls': 0, 'promptTokens': 0, 'completionTokens': 0, 'gpuSeconds': 0.0}
+        for row in rows:
+            entry = {
+                'requests': row['requests'],
+                'llmCalls': row['llm_calls'],
+                'promptTokens': row['prompt_tokens'],
+                'completionTokens': row['completion_tokens'],
+                'gpuSeconds': round(row['gpu_ms'] / 1000, 3)
+            }
+            user = users.setdefault(row['user_id'], {
+                'userId': row['user_id'],
+                'username': row['username'],
+                'totalTokens': 0,
+                'gpuSeconds': 0.0,
+                'endpoints': {}
+            })
+            user['endpoints'][row['endpoint']] = entry
+            user['totalTokens'] += entry['promptTokens'] + entry['completionTokens']
+            user['gpuSeconds'] = round(user['gpuSeconds'] + entry['gpuSeconds'], 3)
+            for field in totals:
+                totals[field] += entry[field]
+        totals['gpuSeconds'] = round(totals['gpuSeconds'], 3)
+
+        return {
+            'success': True,
+            'since': since,
+            'until': until,
+            'users': sorted(users.values(), key=lambda u: u['totalTokens'], reverse=True),
+            'totals': totals
+        }
+    except Exception as e:
+        return {'success': False, 'error': str(e)}